@@ -0,0 +1,317 @@
+"""
+Multi-guild load generator for musicman.
+
+Simulates N guilds with M users each issuing a mix of play, playlist, skip,
+queue and seek commands against the real command handlers in
+musicman.main. The Discord gateway and the Lavalink node are replaced with
+local stand-ins that only add latency, so what gets measured is the bot
+process itself: event-loop lag, memory growth per guild and command latency
+percentiles as the number of active guilds grows. Every guild count runs in
+a fresh process, so memory one level frees doesn't hide the next level's
+growth.
+
+Usage:
+    python benchmarks/loadgen.py --guilds 10,100,500 --users 5 --commands 20
+"""
+from argparse import ArgumentParser
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import gc
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from tracks import fake_track, TITLES
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MUSICMAN_DB', ':memory:')
+os.environ.setdefault(
+    'MUSICMAN_HISTORY', os.path.join(tempfile.mkdtemp(), 'history.log')
+)
+
+from musicman import main  # noqa: E402
+
+
+COMMAND_MIX = {
+    'play': 0.45,
+    'playlist': 0.05,
+    'skip': 0.2,
+    'queue': 0.2,
+    'seek': 0.1,
+}
+
+
+def percentile(samples: list[float], pct: float):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # ru_maxrss is a high-water mark, but it is the best we get off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StubNode:
+    """
+    Stands in for a Lavalink node. Searches resolve after a simulated
+    REST round trip, websocket ops are counted and dropped.
+    """
+
+    def __init__(self, rng: random.Random, latency: float):
+        self.rng = rng
+        self.latency = latency
+        self.available = True
+        self.ops = 0
+
+    async def get_tracks(self, query: str):
+        await asyncio.sleep(self.rng.expovariate(1 / self.latency))
+        if query.startswith('ytsearch:'):
+            title = query[len('ytsearch:'):]
+            return {
+                'loadType': 'SEARCH_RESULT',
+                'playlistInfo': {},
+                'tracks': [fake_track(self.rng, title) for _ in range(5)]
+            }
+        return {
+            'loadType': 'PLAYLIST_LOADED',
+            'playlistInfo': {'name': query, 'selectedTrack': -1},
+            'tracks': [
+                fake_track(self.rng, self.rng.choice(TITLES))
+                for _ in range(self.rng.randint(10, 50))
+            ]
+        }
+
+    async def _send(self, **data):
+        self.ops += 1
+
+    async def _dispatch_event(self, event):
+        await main.history_hook(event)
+
+
+class StubPlayerManager:
+
+    def __init__(self, node: StubNode):
+        self.node = node
+        self.players = {}
+
+    def get(self, guild_id: int):
+        return self.players.get(guild_id)
+
+    def create(self, guild_id: int):
+        if guild_id not in self.players:
+            self.players[guild_id] = main.MusicPlayer(guild_id, self.node)
+        return self.players[guild_id]
+
+
+class StubLavalink:
+
+    def __init__(self, node: StubNode):
+        self.node_manager = SimpleNamespace(
+            nodes=[node], available_nodes=[node]
+        )
+        self.player_manager = StubPlayerManager(node)
+
+
+class StubContext:
+    """
+    Stands in for commands.Context. Outgoing messages pay a simulated
+    gateway round trip and are otherwise discarded.
+    """
+
+    def __init__(
+        self, guild: SimpleNamespace, author: SimpleNamespace,
+        rng: random.Random, latency: float
+    ):
+        self.guild = guild
+        self.author = author
+        self.rng = rng
+        self.latency = latency
+        self.sent = 0
+
+    async def send(self, content: str = None, *, embed=None):
+        await asyncio.sleep(self.rng.expovariate(1 / self.latency))
+        self.sent += 1
+
+
+async def run_command(ctx: StubContext, name: str):
+    rng = ctx.rng
+    if name == 'play':
+        await main.play(ctx, rng.choice(TITLES))
+    elif name == 'playlist':
+        await main.playlist(
+            ctx, f'https://www.youtube.com/playlist?list={rng.getrandbits(32)}'
+        )
+    elif name == 'skip':
+        await main.skip(ctx)
+    elif name == 'queue':
+        await main.view_queue(ctx)
+    elif name == 'seek':
+        await main.seek(ctx, f'{rng.randint(0, 2)}:{rng.randint(0, 59):02}')
+
+
+async def user_session(
+    ctx: StubContext, commands: int, think: float,
+    latencies: dict[str, list[float]]
+):
+    names = list(COMMAND_MIX)
+    weights = list(COMMAND_MIX.values())
+    for _ in range(commands):
+        await asyncio.sleep(ctx.rng.expovariate(1 / think))
+        name = ctx.rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        await run_command(ctx, name)
+        latencies[name].append(time.perf_counter() - start)
+
+
+async def watch_lag(
+    interval: float, samples: list[float], done: asyncio.Event
+):
+    loop = asyncio.get_running_loop()
+    while not done.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+async def run_level(args, guilds: int, seed: int):
+    rng = random.Random(seed)
+    node = StubNode(rng, args.node_latency)
+    main.bot.lavalink = StubLavalink(node)
+    if not args.reuse_history:
+        # Plays are still recorded, but every play pays for its search
+        main.bot.history.recent_match = lambda guild_id, text: None
+
+    gc.collect()
+    rss_before = rss_bytes()
+
+    sessions = []
+    for g in range(guilds):
+        guild = SimpleNamespace(id=10_000 + g)
+        player = main.bot.lavalink.player_manager.create(guild.id)
+        player.channel_id = str(20_000 + g)
+        for u in range(args.users):
+            author = SimpleNamespace(
+                id=guild.id * 1000 + u, name=f'user{u}'
+            )
+            sessions.append(StubContext(
+                guild, author, random.Random(rng.random()),
+                args.gateway_latency
+            ))
+
+    latencies = {name: [] for name in COMMAND_MIX}
+    lag = []
+    done = asyncio.Event()
+    watcher = asyncio.create_task(watch_lag(args.lag_interval, lag, done))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        user_session(ctx, args.commands, args.think, latencies)
+        for ctx in sessions
+    ))
+    elapsed = time.perf_counter() - start
+
+    done.set()
+    await watcher
+
+    gc.collect()
+    rss_after = rss_bytes()
+
+    return {
+        'guilds': guilds,
+        'commands': sum(len(v) for v in latencies.values()),
+        'elapsed': elapsed,
+        'lag': lag,
+        'mem_per_guild': (rss_after - rss_before) / guilds,
+        'latencies': latencies,
+        'queued': sum(
+            len(p.queue)
+            for p in main.bot.lavalink.player_manager.players.values()
+        ),
+    }
+
+
+def measure_level(args, guilds: int, seed: int):
+    return asyncio.run(run_level(args, guilds, seed))
+
+
+def report(result: dict):
+    lag_ms = [s * 1000 for s in result['lag']]
+    print(
+        f'\n== {result["guilds"]} guilds: {result["commands"]} commands in '
+        f'{result["elapsed"]:.1f}s '
+        f'({result["commands"] / result["elapsed"]:.0f} cmd/s), '
+        f'{result["queued"]} tracks queued'
+    )
+    print(
+        f'   loop lag ms   p50 {percentile(lag_ms, 50):7.2f}  '
+        f'p99 {percentile(lag_ms, 99):7.2f}  max {max(lag_ms, default=0):7.2f}'
+    )
+    print(f'   memory        {result["mem_per_guild"] / 1024:.1f} KiB/guild')
+    for name, samples in result['latencies'].items():
+        ms = [s * 1000 for s in samples]
+        print(
+            f'   {name:<12} n={len(ms):<6} p50 {percentile(ms, 50):7.2f}  '
+            f'p95 {percentile(ms, 95):7.2f}  p99 {percentile(ms, 99):7.2f}'
+        )
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description='musicman multi-guild load generator')
+    parser.add_argument(
+        '--guilds', default='10,50,100,250,500',
+        help='Comma separated guild counts to step through'
+    )
+    parser.add_argument('--users', type=int, default=5, help='Users per guild')
+    parser.add_argument(
+        '--commands', type=int, default=20, help='Commands issued per user'
+    )
+    parser.add_argument(
+        '--think', type=float, default=0.5,
+        help='Mean seconds between a user\'s commands'
+    )
+    parser.add_argument(
+        '--node-latency', type=float, default=0.05,
+        help='Mean Lavalink REST round trip in seconds'
+    )
+    parser.add_argument(
+        '--gateway-latency', type=float, default=0.03,
+        help='Mean Discord message round trip in seconds'
+    )
+    parser.add_argument(
+        '--lag-interval', type=float, default=0.01,
+        help='Event-loop lag sampling interval in seconds'
+    )
+    parser.add_argument(
+        '--reuse-history', action='store_true',
+        help='Let play queue recently played tracks without a search'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    spawn = multiprocessing.get_context('spawn')
+    for i, guilds in enumerate(int(g) for g in args.guilds.split(',')):
+        # A history log of its own, so no level starts with another's plays
+        os.environ['MUSICMAN_HISTORY'] = os.path.join(
+            tempfile.mkdtemp(), 'history.log'
+        )
+        with ProcessPoolExecutor(1, mp_context=spawn) as pool:
+            result = pool.submit(measure_level, args, guilds, args.seed + i)
+            report(result.result())
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,97 @@
+"""
+Bytes per queued track, comparing a plain list of AudioTracks built the way
+play_either builds them against a TrackQueue of QueueEntry items.
+
+Every track's strings are created fresh, as they would be when parsed out
+of a Lavalink response, and songs repeat across the queue the way popular
+tracks repeat across guilds.
+
+Usage:
+    python benchmarks/queue_memory.py --entries 100000
+"""
+from argparse import ArgumentParser
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+from typing import Iterator
+from lavalink.models import AudioTrack
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from musicman.util import TrackQueue  # noqa: E402
+from tracks import fake_track, TITLES  # noqa: E402
+
+
+def responses(entries: int, songs: int, users: int, seed: int):
+    rng = random.Random(seed)
+    catalogue = [
+        json.dumps(fake_track(rng, f'{rng.choice(TITLES)} #{i}'))
+        for i in range(songs)
+    ]
+    requesters = [rng.getrandbits(63) for _ in range(users)]
+
+    def generate():
+        for _ in range(entries):
+            # json.loads gives every track its own copy of each string, and
+            # only what the queue keeps hold of stays allocated
+            yield json.loads(rng.choice(catalogue)), rng.choice(requesters)
+
+    return generate()
+
+
+def measure(build, entries: int, songs: int, users: int, seed: int):
+    data = responses(entries, songs, users, seed)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    queue = build(data)
+    gc.collect()
+
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert len(queue) == entries
+    return used
+
+
+def audio_tracks(data: Iterator[tuple[dict, int]]):
+    return [
+        AudioTrack(track, requester, recommended=True)
+        for track, requester in data
+    ]
+
+
+def track_queue(data: Iterator[tuple[dict, int]]):
+    queue = TrackQueue()
+    for track, requester in data:
+        queue.append(AudioTrack(track, requester, recommended=True))
+    return queue
+
+
+def run(argv=None):
+    parser = ArgumentParser(description='musicman queue memory benchmark')
+    parser.add_argument('--entries', type=int, default=100_000)
+    parser.add_argument(
+        '--songs', type=int, default=20_000, help='Distinct songs queued'
+    )
+    parser.add_argument(
+        '--users', type=int, default=2_000, help='Distinct requesters'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    for name, build in (
+        ('list[AudioTrack]', audio_tracks), ('TrackQueue', track_queue)
+    ):
+        used = measure(build, args.entries, args.songs, args.users, args.seed)
+        print(
+            f'{name:<18} {used / 2**20:8.1f} MiB  '
+            f'{used / args.entries:7.1f} bytes/track'
+        )
+
+
+if __name__ == '__main__':
+    run()
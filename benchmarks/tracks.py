@@ -0,0 +1,50 @@
+"""
+Synthetic Lavalink tracks for the benchmarks, encoded the same way a
+Lavalink node encodes them so lavalink.decode_track can read them back.
+"""
+from base64 import b64encode
+import random
+import struct
+from lavalink.datarw import DataWriter
+
+
+TITLES = (
+    'africa', 'hello world', 'bohemian rhapsody', 'take on me',
+    'never gonna give you up', 'mr blue sky', 'september', 'dancing queen',
+    'bushes of love', 'hotel california', 'billie jean', 'toxic',
+)
+
+
+def encode_track(info: dict):
+    writer = DataWriter()
+    writer.write_byte(struct.pack('B', 2))
+    writer.write_utf(info['title'])
+    writer.write_utf(info['author'])
+    writer.write_long(info['length'])
+    writer.write_utf(info['identifier'])
+    writer.write_boolean(info['isStream'])
+    writer.write_boolean(True)
+    writer.write_utf(info['uri'])
+    writer.write_utf('youtube')
+    writer.write_long(0)
+    return b64encode(writer.finish()).decode()
+
+
+def fake_track(rng: random.Random, title: str):
+    identifier = ''.join(
+        rng.choices(
+            'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_',
+            k=11
+        )
+    )
+    info = {
+        'identifier': identifier,
+        'isSeekable': True,
+        'author': f'{title} artist',
+        'length': rng.randint(120, 420) * 1000,
+        'isStream': False,
+        'position': 0,
+        'title': title,
+        'uri': f'https://www.youtube.com/watch?v={identifier}',
+    }
+    return {'track': encode_track(info), 'info': info}
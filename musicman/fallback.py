@@ -0,0 +1,383 @@
+import asyncio
+from collections import deque
+import os
+from random import randrange
+import tempfile
+from time import time
+from traceback import print_exc
+from typing import Callable, Optional, Union
+import discord
+from lavalink.models import AudioTrack
+from musicman.util import ffmpeg_options, get_audio, TrackQueue, ytdl_options
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where msvcrt has the equivalent lock
+    fcntl = None
+    import msvcrt
+
+
+def track_from_info(info: dict):
+    """
+    Shapes a yt-dlp info dict like a track returned by Lavalink's
+    /loadtracks so it can be wrapped in an AudioTrack. There is no encoded
+    track, those only come from a node.
+    """
+    return {
+        'track': None,
+        'info': {
+            'identifier': info.get('id', ''),
+            'isSeekable': not info.get('is_live', False),
+            'author': info.get('uploader') or '',
+            'length': int((info.get('duration') or 0) * 1000),
+            'isStream': bool(info.get('is_live', False)),
+            'title': info.get('title') or '',
+            'uri': info.get('webpage_url') or info.get('url', ''),
+        }
+    }
+
+
+class FallbackNode:
+    """
+    Answers get_tracks with yt-dlp in place of a Lavalink node's REST API.
+    """
+
+    available = True
+
+    async def get_tracks(self, query: str):
+        if query.startswith('ytsearch:'):
+            query = query[len('ytsearch:'):]
+
+        loop = asyncio.get_running_loop()
+        info = await loop.run_in_executor(None, get_audio, ytdl_options, query)
+
+        if not info:
+            return {'loadType': 'NO_MATCHES', 'playlistInfo': {}, 'tracks': []}
+
+        return {
+            'loadType': 'TRACK_LOADED',
+            'playlistInfo': {},
+            'tracks': [track_from_info(info)]
+        }
+
+
+class FallbackPlayer:
+    """
+    Plays a guild's queue through discord.py's own voice client while no
+    Lavalink node is available. Mirrors the parts of lavalink.DefaultPlayer
+    the commands use, so they work with either player.
+
+    Sources are opened with FFmpegOpusAudio.from_probe, which copies opus
+    streams straight through instead of transcoding them.
+    """
+
+    def __init__(self, manager: 'FallbackManager', guild_id: int):
+        self.manager = manager
+        self.guild_id = guild_id
+        self.node = manager.node
+        self.voiceclient: Optional[discord.VoiceClient] = None
+
+        self.queue = TrackQueue()
+        self.current: Optional[AudioTrack] = None
+        self.paused = False
+        self.repeat = False
+        self.shuffle = False
+        self.position_timestamp = 0
+
+        # Position is tracked locally: _offset ms into the track at _started
+        self._offset = 0
+        self._started = 0.0
+        # Bumped whenever playback is stopped on purpose, so the after
+        # callback of the old source doesn't advance the queue
+        self._generation = 0
+
+    @property
+    def is_connected(self):
+        return (
+            self.voiceclient is not None and self.voiceclient.is_connected()
+        )
+
+    @property
+    def channel_id(self):
+        return self.voiceclient.channel.id if self.is_connected else None
+
+    @property
+    def is_playing(self):
+        return self.is_connected and self.current is not None
+
+    @property
+    def position(self):
+        if not self.is_playing:
+            return 0
+
+        if self.paused:
+            return min(self._offset, self.current.duration)
+
+        elapsed = (time() - self._started) * 1000
+        return min(self._offset + elapsed, self.current.duration)
+
+    def add(
+        self, requester: int, track: Union[AudioTrack, dict],
+        index: int = None
+    ):
+        at = AudioTrack(track, requester) if isinstance(track, dict) else track
+
+        if index is None:
+            self.queue.append(at)
+        else:
+            self.queue.insert(index, at)
+
+    def set_repeat(self, repeat: bool):
+        self.repeat = repeat
+
+    def set_shuffle(self, shuffle: bool):
+        self.shuffle = shuffle
+
+    async def play(
+        self, track: Union[AudioTrack, dict] = None, start_time: int = 0
+    ):
+        # Leave the queue alone until there is somewhere to play it
+        if not self.is_connected:
+            self.manager.release(self)
+            return
+
+        if track is not None and isinstance(track, dict):
+            track = AudioTrack(track, 0)
+
+        if self.repeat and self.current:
+            self.queue.append(self.current)
+
+        if not track:
+            if not self.queue:
+                return await self.stop()
+
+            pop_at = randrange(len(self.queue)) if self.shuffle else 0
+            track = self.queue.pop(pop_at)
+
+        self.current = track
+        await self._start(start_time)
+
+    async def stop(self):
+        self._halt()
+        self.current = None
+        self.manager.release(self)
+
+    async def skip(self):
+        await self.play()
+
+    async def seek(self, position: int):
+        if self.current:
+            await self._start(position)
+
+    async def set_pause(self, pause: bool):
+        if not self.is_connected:
+            return
+
+        if pause and not self.paused:
+            self._offset = self.position
+            self.voiceclient.pause()
+        elif not pause and self.paused:
+            self._started = time()
+            self.voiceclient.resume()
+
+        self.paused = pause
+
+    def _halt(self):
+        self._generation += 1
+        if self.voiceclient and (
+            self.voiceclient.is_playing() or self.voiceclient.is_paused()
+        ):
+            self.voiceclient.stop()
+
+    async def _start(self, start_time: int):
+        self._halt()
+        self.paused = False
+        self._offset = start_time
+        self._started = time()
+
+        # A player keeps its slot from track to track, skips and seeks
+        # included, until it stops or disconnects
+        if not self.manager.acquire(self):
+            # Picked up again by the manager once a process slot frees
+            return
+
+        loop = asyncio.get_running_loop()
+        generation = self._generation
+        track = self.current
+
+        info = await loop.run_in_executor(
+            None, get_audio, ytdl_options, track.uri
+        )
+        if generation != self._generation:
+            return
+        if not info:
+            return await self.play()
+
+        try:
+            source = await discord.FFmpegOpusAudio.from_probe(
+                info['url'], method='fallback',
+                **ffmpeg_options(start_time // 1000)
+            )
+        except Exception:
+            # Nothing awaits this when the manager or the previous track
+            # started it, so log it and move on to the next track
+            print_exc()
+            if generation == self._generation:
+                await self.play()
+            return
+
+        if generation != self._generation:
+            source.cleanup()
+            return
+        if not self.is_connected:
+            source.cleanup()
+            self.manager.release(self)
+            return
+
+        self.voiceclient.play(
+            source, after=lambda e: loop.call_soon_threadsafe(
+                self._finished, generation
+            )
+        )
+        self._started = time()
+        self.position_timestamp = int(self._started * 1000)
+        if self.manager.on_track_start:
+            try:
+                self.manager.on_track_start(self, track)
+            except Exception:
+                # Playback goes on whatever the callback runs into
+                print_exc()
+
+    def _finished(self, generation: int):
+        # Sources halted on purpose are already being replaced
+        if generation == self._generation:
+            asyncio.ensure_future(self.play())
+
+
+class ProcessSlots:
+    """
+    ffmpeg process slots shared by every bot process on the host, as lock
+    files in a directory. A slot is taken by locking its file and stays
+    taken until the file is closed, which the OS also does for a process
+    that dies.
+    """
+
+    def __init__(self, count: int, path: str):
+        self.count = count
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def take(self) -> Optional[int]:
+        for i in range(self.count):
+            fd = os.open(
+                os.path.join(self.path, f'slot-{i}.lock'),
+                os.O_RDWR | os.O_CREAT, 0o666
+            )
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def free(self, fd: int):
+        if not fcntl:
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+
+class FallbackManager:
+    """
+    Keeps the fallback players and caps how many ffmpeg processes run on
+    this host at once, across every bot process on it
+    (FFMPEG_MAX_PROCESSES, defaults to two per CPU; the slots live in
+    FFMPEG_SLOT_DIR). Players that can't get a slot wait in line and
+    start, at the position they were asked for, as soon as one frees up.
+
+    on_track_start, if set, is called with the player and track whenever a
+    track starts, standing in for Lavalink's TrackStartEvent.
+    """
+
+    # Seconds between checks for slots freed by other processes
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, max_processes: int = None, slot_dir: str = None):
+        self.node = FallbackNode()
+        self.players: dict[int, FallbackPlayer] = {}
+        self.slots = ProcessSlots(
+            max_processes or int(
+                os.getenv('FFMPEG_MAX_PROCESSES', 2 * (os.cpu_count() or 1))
+            ),
+            slot_dir or os.getenv('FFMPEG_SLOT_DIR') or os.path.join(
+                tempfile.gettempdir(), 'musicman-ffmpeg'
+            )
+        )
+        self._holding: dict[FallbackPlayer, int] = {}
+        self._waiting: deque[FallbackPlayer] = deque()
+        self._poller: Optional[asyncio.Future] = None
+        self.on_track_start: Optional[
+            Callable[[FallbackPlayer, AudioTrack], None]
+        ] = None
+
+    def get(self, guild_id: int):
+        if guild_id not in self.players:
+            self.players[guild_id] = FallbackPlayer(self, guild_id)
+        return self.players[guild_id]
+
+    def remove(self, guild_id: int):
+        player = self.players.pop(guild_id, None)
+        if player:
+            self.release(player)
+        return player
+
+    def acquire(self, player: FallbackPlayer):
+        if player in self._holding:
+            return True
+
+        # Slots go to players already waiting first
+        if not self._waiting:
+            fd = self.slots.take()
+            if fd is not None:
+                self._holding[player] = fd
+                return True
+
+        if player not in self._waiting:
+            self._waiting.append(player)
+        self._hand_out()
+        if self._waiting and (self._poller is None or self._poller.done()):
+            self._poller = asyncio.ensure_future(self._poll())
+        return False
+
+    def release(self, player: FallbackPlayer):
+        if player in self._waiting:
+            self._waiting.remove(player)
+
+        fd = self._holding.pop(player, None)
+        if fd is not None:
+            self.slots.free(fd)
+            self._hand_out()
+
+    def _hand_out(self):
+        while self._waiting:
+            player = self._waiting[0]
+            player_live = self.players.get(player.guild_id) is player
+            if not (player.is_playing and player_live):
+                self._waiting.popleft()
+                continue
+
+            fd = self.slots.take()
+            if fd is None:
+                break
+
+            self._waiting.popleft()
+            self._holding[player] = fd
+            asyncio.ensure_future(player._start(player._offset))
+
+    async def _poll(self):
+        while self._waiting:
+            await asyncio.sleep(self.POLL_INTERVAL)
+            self._hand_out()
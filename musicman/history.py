@@ -0,0 +1,262 @@
+import asyncio
+from base64 import b64decode, b64encode
+from difflib import SequenceMatcher
+from heapq import nlargest
+import json
+import os
+import re
+from time import time
+from typing import Optional
+from lavalink.models import AudioTrack
+from musicman.util import QueueEntry
+
+
+# How long ago a track may have been played for !play to reuse it
+RECENT = 30 * 24 * 3600
+# How similar a title must be to the query for !play to reuse the track
+STRONG_MATCH = 0.9
+
+word_rx = re.compile(r'\w+')
+
+
+def words(text: str):
+    return word_rx.findall(text.lower())
+
+
+def trigrams(word: str):
+    # The leading space anchors grams to the start of the word, so every
+    # gram of a query word is also a gram of any title word it prefixes
+    padded = f' {word}'
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+def title_grams(title: str):
+    return set().union(*(trigrams(w) for w in words(title)))
+
+
+class HistoryItem:
+
+    __slots__ = ('entry', 'played_at')
+
+    def __init__(self, entry: QueueEntry, played_at: int):
+        self.entry = entry
+        self.played_at = played_at
+
+
+class GuildHistory:
+    """
+    The tracks one guild has played, keyed by URI, with a trigram index
+    over the words of their titles.
+    """
+
+    __slots__ = ('items', 'index')
+
+    def __init__(self):
+        self.items: dict[str, HistoryItem] = {}
+        self.index: dict[str, set[str]] = {}
+
+    def add(self, key: str, entry: QueueEntry, played_at: int):
+        item = self.items.get(key)
+        if item is None:
+            self._index(key, entry.title)
+            self.items[key] = HistoryItem(entry, played_at)
+        elif played_at >= item.played_at:
+            if entry.title != item.entry.title:
+                self._unindex(key, item.entry.title)
+                self._index(key, entry.title)
+            item.entry = entry
+            item.played_at = played_at
+
+    def discard(self, key: str):
+        item = self.items.pop(key)
+        self._unindex(key, item.entry.title)
+
+    def _index(self, key: str, title: str):
+        for gram in title_grams(title):
+            self.index.setdefault(gram, set()).add(key)
+
+    def _unindex(self, key: str, title: str):
+        # Grams are a set, so titles repeating a word drop each one once
+        for gram in title_grams(title):
+            keys = self.index[gram]
+            keys.discard(key)
+            if not keys:
+                del self.index[gram]
+
+    def search(self, text: str, limit: int):
+        """
+        Returns up to limit items, most recently played first, where every
+        word of text starts some word of the title. With no words in text
+        that is simply the most recent items.
+        """
+        query = words(text)
+        grams = set().union(*(trigrams(w) for w in query))
+
+        if grams:
+            postings = sorted(
+                (self.index.get(g, set()) for g in grams), key=len
+            )
+            keys = postings[0].intersection(*postings[1:])
+        else:
+            keys = self.items.keys()
+
+        matches = []
+        for key in keys:
+            item = self.items[key]
+            title = words(item.entry.title)
+            if all(any(w.startswith(q) for w in title) for q in query):
+                matches.append(item)
+
+        return nlargest(limit, matches, key=lambda i: i.played_at)
+
+
+class PlayHistory:
+    """
+    Tracks each guild has played, kept in memory and in an append-only log
+    at MUSICMAN_HISTORY (defaults to history.log). A play costs one short
+    line appended to the log; compact() periodically rewrites it down to
+    the newest keep tracks per guild.
+    """
+
+    def __init__(self, path: str = None, keep: int = 500):
+        self.path = path or os.getenv('MUSICMAN_HISTORY', 'history.log')
+        self.keep = keep
+        self.guilds: dict[int, GuildHistory] = {}
+        self._lines = 0
+        # Lines appended while compact() is writing the new log
+        self._pending: Optional[list[str]] = None
+
+        self._load()
+        self._log = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    self._apply(json.loads(line))
+                except ValueError:
+                    # Torn write from a crash, the rest of the log is fine
+                    continue
+                self._lines += 1
+
+        self._trim()
+
+    def _apply(self, record: list):
+        guild_id, played_at, key, track, title, duration, requester, uri = (
+            record
+        )
+        entry = QueueEntry(
+            b64decode(track) if track else None, title, duration, requester,
+            uri
+        )
+        self.guilds.setdefault(guild_id, GuildHistory()).add(
+            key, entry, played_at
+        )
+
+    def _trim(self):
+        for history in self.guilds.values():
+            excess = len(history.items) - self.keep
+            if excess > 0:
+                oldest = sorted(
+                    history.items, key=lambda k: history.items[k].played_at
+                )
+                for key in oldest[:excess]:
+                    history.discard(key)
+
+    def record(self, guild_id: int, track: AudioTrack):
+        record = [
+            guild_id, int(time()), track.uri or track.identifier, track.track,
+            track.title, track.duration, track.requester, track.uri
+        ]
+        self._apply(record)
+
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        self._log.write(line)
+        self._log.flush()
+        self._lines += 1
+        if self._pending is not None:
+            self._pending.append(line)
+
+    def search(self, guild_id: int, text: str, limit: int = 10):
+        history = self.guilds.get(guild_id)
+        return history.search(text, limit) if history else []
+
+    def recent_match(self, guild_id: int, text: str):
+        """
+        Returns the guild's most recently played track whose title is
+        close to all of text, not just prefixed by its words, if it was
+        played within RECENT and has an encoded track to replay.
+        """
+        history = self.guilds.get(guild_id)
+        query = ' '.join(words(text))
+        if not (history and query):
+            return None
+
+        for item in history.search(text, len(history.items)):
+            if item.played_at < time() - RECENT:
+                break
+
+            title = ' '.join(words(item.entry.title))
+            ratio = SequenceMatcher(None, query, title).ratio()
+            if item.entry.blob and ratio >= STRONG_MATCH:
+                return item
+        return None
+
+    async def compact(self):
+        """
+        Rewrites the log with one line per track still kept, if it has
+        grown past twice that. The new log is encoded and written off the
+        event loop, plays recorded meanwhile are carried over before it
+        replaces the old one. Returns whether the log was rewritten.
+        """
+        self._trim()
+        live = sum(len(h.items) for h in self.guilds.values())
+        if self._lines <= 2 * live:
+            return False
+
+        # Only plain tuples are gathered here, encoding them happens in
+        # the executor along with the write
+        records = [
+            (
+                guild_id, item.played_at, key, item.entry.blob,
+                item.entry.title, item.entry.duration, item.entry.requester,
+                item.entry.uri
+            )
+            for guild_id, history in self.guilds.items()
+            for key, item in history.items.items()
+        ]
+        tmp = f'{self.path}.tmp'
+
+        self._pending = []
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, write_records, tmp, records)
+            with open(tmp, 'a', encoding='utf-8') as f:
+                f.writelines(self._pending)
+
+            self._log.close()
+            try:
+                os.replace(tmp, self.path)
+            finally:
+                # Whichever log is in place, record() needs it open
+                self._log = open(self.path, 'a', encoding='utf-8')
+            self._lines = len(records) + len(self._pending)
+        finally:
+            self._pending = None
+
+        return True
+
+
+def write_records(path: str, records: list[tuple]):
+    with open(path, 'w', encoding='utf-8') as f:
+        for guild_id, played_at, key, blob, *rest in records:
+            track = b64encode(blob).decode() if blob else None
+            f.write(json.dumps(
+                [guild_id, played_at, key, track, *rest],
+                separators=(',', ':')
+            ) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import sqlite3
+from time import time
+from typing import Awaitable, Callable, Optional
+import lavalink
+from lavalink.models import AudioTrack
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS playlists (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (guild_id, name)
+);
+CREATE TABLE IF NOT EXISTS playlist_tracks (
+    playlist_id INTEGER NOT NULL REFERENCES playlists (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    track TEXT NOT NULL,
+    checked_at INTEGER NOT NULL,
+    PRIMARY KEY (playlist_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS playlist_tracks_checked_at
+    ON playlist_tracks (checked_at);
+'''
+
+
+class Library:
+    """
+    Saved playlists, kept as the encoded track strings Lavalink hands out.
+    Titles, lengths and URIs are all inside the encoded track, so loading a
+    playlist is one query plus local decoding, with no searches.
+
+    Stored in SQLite at MUSICMAN_DB (defaults to musicman.db).
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('MUSICMAN_DB', 'musicman.db')
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.executescript(SCHEMA)
+        # When tracks that failed to revalidate may be tried again, keyed by
+        # (playlist_id, position)
+        self._retry_at: dict[tuple[int, int], float] = {}
+
+    def save(self, guild_id: int, name: str, tracks: list[AudioTrack]):
+        """
+        Stores tracks under name for the guild, replacing any playlist
+        already saved with that name. Tracks without an encoded form (ones
+        found by the fallback player) are skipped. Returns how many tracks
+        were saved.
+        """
+        now = int(time())
+        encoded = [t.track for t in tracks if t.track]
+
+        with self.db:
+            self.db.execute(
+                'DELETE FROM playlists WHERE guild_id = ? AND name = ?',
+                (guild_id, name)
+            )
+            playlist_id = self.db.execute(
+                'INSERT INTO playlists (guild_id, name) VALUES (?, ?)',
+                (guild_id, name)
+            ).lastrowid
+            self.db.executemany(
+                'INSERT INTO playlist_tracks '
+                '(playlist_id, position, track, checked_at) '
+                'VALUES (?, ?, ?, ?)',
+                (
+                    (playlist_id, i, track, now)
+                    for i, track in enumerate(encoded)
+                )
+            )
+
+        return len(encoded)
+
+    def load(
+        self, guild_id: int, name: str, requester: int
+    ) -> Optional[list[AudioTrack]]:
+        """
+        Returns the saved playlist's tracks in order, attributed to
+        requester, or None if the guild has no playlist by that name.
+        """
+        row = self.db.execute(
+            'SELECT id FROM playlists WHERE guild_id = ? AND name = ?',
+            (guild_id, name)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        tracks = []
+        for track, in self.db.execute(
+            'SELECT track FROM playlist_tracks WHERE playlist_id = ? '
+            'ORDER BY position',
+            row
+        ):
+            at = lavalink.decode_track(track)
+            at.requester = requester
+            tracks.append(at)
+
+        return tracks
+
+    def names(self, guild_id: int):
+        return [
+            name for name, in self.db.execute(
+                'SELECT name FROM playlists WHERE guild_id = ? ORDER BY name',
+                (guild_id,)
+            )
+        ]
+
+    async def revalidate(
+        self, get_tracks: Callable[[str], Awaitable[dict]],
+        max_age: float, batch: int = 50, delay: float = 1.0,
+        retry: float = 3600
+    ):
+        """
+        Re-resolves tracks that haven't been checked for max_age seconds
+        and stores the encoded track the node hands back now. Tracks that
+        don't resolve are kept as they are and still count as unchecked,
+        but are left alone for retry seconds so they don't hold up the
+        rest. Works through at most batch tracks, pausing delay seconds
+        between lookups so the node isn't flooded. Returns how many tracks
+        were refreshed.
+        """
+        now = int(time())
+        stale = []
+        for playlist_id, position, track in self.db.execute(
+            'SELECT playlist_id, position, track FROM playlist_tracks '
+            'WHERE checked_at < ? ORDER BY checked_at',
+            (now - max_age,)
+        ):
+            if self._retry_at.get((playlist_id, position), 0) <= now:
+                stale.append((playlist_id, position, track))
+                if len(stale) == batch:
+                    break
+
+        refreshed = 0
+        for playlist_id, position, track in stale:
+            uri = lavalink.decode_track(track).uri
+            results = await get_tracks(uri) if uri else None
+
+            if results and results['tracks']:
+                self._retry_at.pop((playlist_id, position), None)
+                with self.db:
+                    self.db.execute(
+                        'UPDATE playlist_tracks SET track = ?, checked_at = ? '
+                        'WHERE playlist_id = ? AND position = ?',
+                        (results['tracks'][0]['track'], now, playlist_id,
+                         position)
+                    )
+                refreshed += 1
+            else:
+                self._retry_at[playlist_id, position] = time() + retry
+
+            await asyncio.sleep(delay)
+
+        return refreshed
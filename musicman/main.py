@@ -1,13 +1,19 @@
-from datetime import timedelta as td
+import asyncio
 import os
-import re
+import random
+from traceback import print_exc
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
 import lavalink
+from lavalink import format_time
 from lavalink.models import AudioTrack
 from pytimeparse.timeparse import timeparse
-from musicman.util import handle_spotify
+from musicman.fallback import FallbackManager
+from musicman.history import PlayHistory
+from musicman.library import Library
+from musicman.matching import SpotifyMatcher
+from musicman.util import get_spotify_tracks, TrackQueue, url_rx
 
 
 load_dotenv()
@@ -19,15 +25,35 @@ bot = commands.Bot(
     command_prefix='!',
     help_command=commands.DefaultHelpCommand(no_category='Commands')
 )
+bot.fallback = FallbackManager()
+bot.library = Library()
+bot.history = PlayHistory()
+bot.matcher = SpotifyMatcher()
+bot.fallback.on_track_start = (
+    lambda player, track: bot.history.record(player.guild_id, track)
+)
 
 
 @bot.event
 async def on_ready():
-    bot.lavalink = lavalink.Client(bot.user.id)
+    bot.lavalink = lavalink.Client(bot.user.id, player=MusicPlayer)
+    # Keep reconnecting for as long as the node is down, so guilds on the
+    # fallback player are handed back whenever it returns
     bot.lavalink.add_node(
         'localhost', 2333, os.getenv('LAVALINK_PASSWORD'), 'us',
-        name='default-node'
+        name='default-node', reconnect_attempts=-1
     )
+    bot.lavalink.add_event_hook(node_hook)
+    bot.lavalink.add_event_hook(history_hook)
+
+    if not hasattr(bot, 'history_task'):
+        bot.history_task = bot.loop.create_task(compact_history())
+
+    revalidate_hours = os.getenv('LIBRARY_REVALIDATE_HOURS')
+    if revalidate_hours and not hasattr(bot, 'revalidate_task'):
+        bot.revalidate_task = bot.loop.create_task(
+            revalidate_library(float(revalidate_hours) * 3600)
+        )
 
     # lavalink.add_event_hook(track_hook)
 
@@ -43,7 +69,74 @@ async def on_ready():
 #         await guild.voice_client.disconnect(force=True)
 
 
-url_rx = re.compile(r'https?://(?:www\.)?.+')
+async def node_hook(event):
+    # Move guilds onto the fallback player when the last node goes away and
+    # back onto Lavalink as soon as one reconnects. Each handoff runs as its
+    # own task, Lavalink waits for this hook before it tries to reconnect
+    if isinstance(event, lavalink.events.NodeConnectedEvent):
+        for guild_id in list(bot.fallback.players):
+            bot.loop.create_task(to_lavalink(guild_id))
+    elif isinstance(event, lavalink.events.NodeDisconnectedEvent):
+        if not bot.lavalink.node_manager.available_nodes:
+            for guild_id, player in list(bot.lavalink.player_manager):
+                if player.is_connected:
+                    bot.loop.create_task(to_fallback(guild_id, player))
+
+
+async def history_hook(event):
+    if isinstance(event, lavalink.events.TrackStartEvent):
+        bot.history.record(int(event.player.guild_id), event.track)
+
+
+async def compact_history():
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            await bot.history.compact()
+        except Exception:
+            # A full disk or similar shouldn't stop the next attempt
+            print_exc()
+
+
+async def revalidate_library(max_age: float):
+    # Refresh saved playlist entries a batch at a time in the background
+    while True:
+        try:
+            await bot.library.revalidate(bot.lavalink.get_tracks, max_age)
+        except lavalink.NodeException:
+            pass
+        except Exception:
+            # Connection errors and timeouts from the node included, the
+            # next batch may well succeed
+            print_exc()
+        await asyncio.sleep(60)
+
+
+class MusicPlayer(lavalink.DefaultPlayer):
+    """
+    DefaultPlayer with a TrackQueue, so queued tracks are kept compact and
+    only the one about to play is a full AudioTrack.
+    """
+
+    def __init__(self, guild_id: int, node: lavalink.Node):
+        super().__init__(guild_id, node)
+        self.queue = TrackQueue()
+
+    @property
+    def position(self):
+        # Until the node's first playerUpdate _last_update is 0, which
+        # DefaultPlayer reads as the whole track having played
+        if self.is_playing and not self.paused and not self._last_update:
+            return min(self._last_position, self.current.duration)
+        return super().position
+
+    async def play(
+        self, track: AudioTrack = None, start_time: int = 0,
+        end_time: int = 0, no_replace: bool = False
+    ):
+        await super().play(track, start_time, end_time, no_replace)
+        if not self._last_update:
+            self._last_position = start_time
 
 
 class LavalinkVoiceClient(discord.VoiceClient):
@@ -63,13 +156,16 @@ class LavalinkVoiceClient(discord.VoiceClient):
         if hasattr(self.client, 'lavalink'):
             self.lavalink = self.client.lavalink
         else:
-            self.client.lavalink = lavalink.Client(client.user.id)
+            self.client.lavalink = lavalink.Client(
+                client.user.id, player=MusicPlayer
+            )
             self.client.lavalink.add_node(
                     'localhost',
                     2333,
                     os.getenv('LAVALINK_PASSWORD'),
                     'us',
-                    name='default-node')
+                    name='default-node',
+                    reconnect_attempts=-1)
             self.lavalink = self.client.lavalink
 
     async def on_voice_server_update(self, data):
@@ -121,50 +217,172 @@ class LavalinkVoiceClient(discord.VoiceClient):
         self.cleanup()
 
 
+def get_player(guild_id: int):
+    """
+    Returns the guild's Lavalink player, or its fallback player while no
+    Lavalink node is available.
+    """
+    if bot.lavalink.node_manager.available_nodes:
+        return bot.lavalink.player_manager.get(guild_id)
+    return bot.fallback.get(guild_id)
+
+
+def time_until(player: lavalink.DefaultPlayer, index: int):
+    """
+    Milliseconds until the queue entry at index starts playing. An index of
+    len(player.queue) gives the time until the queue runs out.
+    """
+    eta = player.queue.eta(index)
+    if player.is_playing and not player.current.stream:
+        eta += max(0, player.current.duration - int(player.position))
+    return eta
+
+
+async def with_encoded_track(
+    player: lavalink.DefaultPlayer, track: AudioTrack
+):
+    # Tracks queued on the fallback player were found by yt-dlp and have no
+    # encoded track for Lavalink to play yet
+    if track.track:
+        return track
+
+    results = await player.node.get_tracks(track.uri)
+    if not (results and results['tracks']):
+        return None
+    return AudioTrack(results['tracks'][0], track.requester)
+
+
+async def to_fallback(guild_id: int, player: lavalink.DefaultPlayer):
+    guild: discord.Guild = bot.get_guild(guild_id)
+    channel = guild.get_channel(int(player.channel_id))
+
+    # Hand the queue over before anything can fail, so a guild that can't
+    # reconnect still has it for !connect
+    fallback = bot.fallback.get(guild_id)
+    fallback.queue.extend(player.queue)
+    fallback.set_repeat(player.repeat)
+    fallback.set_shuffle(player.shuffle)
+    current, position = player.current, int(player.position)
+
+    if guild.voice_client:
+        await guild.voice_client.disconnect(force=True)
+    bot.lavalink.player_manager.remove(guild_id)
+
+    try:
+        fallback.voiceclient = await channel.connect()
+    except Exception:
+        print_exc()
+        if current:
+            fallback.queue.insert(0, current)
+        return
+
+    if current:
+        await fallback.play(current, start_time=position)
+    elif fallback.queue:
+        await fallback.play()
+
+
+async def to_lavalink(guild_id: int):
+    fallback = bot.fallback.remove(guild_id)
+    if fallback is None:
+        return
+
+    channel = fallback.voiceclient.channel if fallback.is_connected else None
+    current, position = fallback.current, int(fallback.position)
+    queue = list(fallback.queue)
+    await fallback.stop()
+
+    if channel:
+        await fallback.voiceclient.disconnect(force=True)
+        await channel.connect(cls=LavalinkVoiceClient)
+
+    # A guild that isn't in a voice channel keeps its queue for !connect
+    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.create(
+        guild_id
+    )
+    player.set_repeat(fallback.repeat)
+    player.set_shuffle(fallback.shuffle)
+
+    if current:
+        current = await with_encoded_track(player, current)
+    for track in queue:
+        track = await with_encoded_track(player, track)
+        if track:
+            player.add(requester=track.requester, track=track)
+
+    if not channel:
+        if current:
+            player.add(requester=current.requester, track=current, index=0)
+    elif current:
+        await player.play(
+            current, start_time=min(position, current.duration)
+        )
+    elif player.queue:
+        await player.play()
+
+
 async def play_either(ctx: commands.Context, top: bool, src: str, *args):
 
     SP_CLIENT = os.getenv('SP_CLIENT')
     SP_SECRET = os.getenv('SP_SECRET')
 
+    player = get_player(ctx.guild.id)
+
+    track = None
     if 'open.spotify.com' in [s.lower() for s in src.split('/')]:
-        src = handle_spotify(SP_CLIENT, SP_SECRET, src)
-        if isinstance(src, list):
+        if src.split('/')[-2].lower() != 'track':
             return await ctx.send(
                 'Use the !playlist command to queue playlists'
             )
+
+        sp_tracks = get_spotify_tracks(SP_CLIENT, SP_SECRET, src)
+        if sp_tracks:
+            track = await bot.matcher.resolve(
+                sp_tracks[0], player.node.get_tracks, ctx.author.id
+            )
+        if track is None:
+            return await ctx.send(f'No results found for "{src}"')
     else:
         src = ' '.join([src, *args])
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
 
     src = src.strip('<>')
 
-    if not url_rx.match(src):
-        src = f'ytsearch:{src}'
+    if track is None and not url_rx.match(src):
+        # Something this guild played recently can be queued without a search
+        played = bot.history.recent_match(ctx.guild.id, src)
+        if played:
+            track = played.entry.materialise()
+            track.requester = ctx.author.id
+        else:
+            src = f'ytsearch:{src}'
 
-    results = await player.node.get_tracks(src)
+    if track is None:
+        results = await player.node.get_tracks(src)
 
-    if not (results and results['tracks']):
-        return await ctx.send(f'No results found for "{src}"')
+        if not (results and results['tracks']):
+            return await ctx.send(f'No results found for "{src}"')
 
-    embed = discord.Embed(color=discord.Color.blurple())
-
-    if results['loadType'] == 'PLAYLIST_LOADED':
-        return await ctx.send('Use the !playlist command to queue playlists')
-    else:
-        track = results['tracks'][0]
-        embed.title = 'Track Enqueued'
-        embed.description = (
-            f'[{track["info"]["title"]}]({track["info"]["uri"]})'
-        )
+        if results['loadType'] == 'PLAYLIST_LOADED':
+            return await ctx.send(
+                'Use the !playlist command to queue playlists'
+            )
 
         # You can attach additional information to audiotracks through kwargs,
         # however this involves constructing the AudioTrack class yourself.
         track = lavalink.models.AudioTrack(
-            track, ctx.author.id, recommended=True
+            results['tracks'][0], ctx.author.id, recommended=True
+        )
+
+    embed = discord.Embed(color=discord.Color.blurple())
+    embed.title = 'Track Enqueued'
+    embed.description = f'[{track.title}]({track.uri})'
+    player.add(requester=ctx.author.id, track=track)
+    if player.is_playing:
+        embed.add_field(name='Position', value=len(player.queue))
+        embed.add_field(
+            name='Starts in',
+            value=format_time(time_until(player, len(player.queue) - 1))
         )
-        player.add(requester=ctx.author.id, track=track)
 
     await ctx.send(embed=embed)
 
@@ -182,7 +400,16 @@ async def connect(ctx: commands.Context, *args):
     # ms: MusicState = get_ms(ctx.guild.id)
     channel: discord.VoiceChannel = ctx.author.voice.channel
     if channel:
-        await ctx.author.voice.channel.connect(cls=LavalinkVoiceClient)
+        if bot.lavalink.node_manager.available_nodes:
+            await channel.connect(cls=LavalinkVoiceClient)
+            player = bot.lavalink.player_manager.get(ctx.guild.id)
+            if player.queue and not player.is_playing:
+                await player.play()
+        else:
+            player = bot.fallback.get(ctx.guild.id)
+            player.voiceclient = await channel.connect()
+            if player.queue and not player.is_playing:
+                await player.play()
         await ctx.send(f'musicman connected to {channel.name}')
     else:
         await ctx.send(f'{ctx.author.name} is not in a voice channel')
@@ -206,9 +433,7 @@ async def playlist(ctx: commands.Context, src: str, *args):
     SP_CLIENT = os.getenv('SP_CLIENT')
     SP_SECRET = os.getenv('SP_SECRET')
 
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
 
     if player.is_connected:
 
@@ -220,14 +445,17 @@ async def playlist(ctx: commands.Context, src: str, *args):
         embed.title = 'Playlist Enqueued!'
 
         if 'open.spotify.com' in [s.lower() for s in src.split('/')]:
-            sp_tracks = handle_spotify(SP_CLIENT, SP_SECRET, src)
+            sp_tracks = get_spotify_tracks(SP_CLIENT, SP_SECRET, src)
 
-            for track in sp_tracks:
-                track_url = track
-                if not url_rx.match(track_url):
-                    track_url = f'ytsearch:{track_url}'
-                result = await player.node.get_tracks(track_url)
-                tracks.append(result['tracks'][0])
+            if not sp_tracks:
+                return await ctx.send(f'No results found for "{src}"')
+
+            for sp_track in sp_tracks:
+                track = await bot.matcher.resolve(
+                    sp_track, player.node.get_tracks, ctx.author.id
+                )
+                if track:
+                    tracks.append(track)
 
             embed.description = f'{src} - {len(tracks)} tracks'
         else:
@@ -255,6 +483,10 @@ async def playlist(ctx: commands.Context, src: str, *args):
         for track in tracks:
             player.add(requester=ctx.author.id, track=track)
 
+        embed.add_field(
+            name='Queue time',
+            value=format_time(time_until(player, len(player.queue)))
+        )
         await ctx.send(embed=embed)
 
         if not player.is_playing:
@@ -264,13 +496,101 @@ async def playlist(ctx: commands.Context, src: str, *args):
         await ctx.send("musicman must be in a channel first")
 
 
+@bot.command(
+    name='save', help='Saves the queue as a playlist with the given name.'
+)
+async def save(ctx: commands.Context, name: str, *args):
+    player = get_player(ctx.guild.id)
+
+    tracks = ([player.current] if player.current else []) + list(player.queue)
+    if not tracks:
+        return await ctx.send('Queue empty, nothing to save')
+
+    name = ' '.join([name, *args])
+    saved = bot.library.save(ctx.guild.id, name, tracks)
+    await ctx.send(f'Saved {saved} tracks as "{name}"')
+
+
+@bot.command(name='load', help='Queues a playlist saved with !save.')
+async def load(ctx: commands.Context, name: str, *args):
+    player = get_player(ctx.guild.id)
+
+    if not player.is_connected:
+        return await ctx.send('musicman must be in a channel first')
+
+    name = ' '.join([name, *args])
+    tracks = bot.library.load(ctx.guild.id, name, ctx.author.id)
+    if tracks is None:
+        return await ctx.send(f'No saved playlist named "{name}"')
+
+    player.queue.extend(tracks)
+
+    embed = discord.Embed(color=discord.Color.blurple())
+    embed.title = 'Playlist Enqueued!'
+    embed.description = f'{name} - {len(tracks)} tracks'
+    embed.add_field(
+        name='Queue time',
+        value=format_time(time_until(player, len(player.queue)))
+    )
+    await ctx.send(embed=embed)
+
+    if not player.is_playing:
+        await player.play()
+
+
+@bot.command(name='saved', help='Lists the playlists saved with !save.')
+async def saved(ctx: commands.Context, *args):
+    names = bot.library.names(ctx.guild.id)
+    if names:
+        await ctx.send('Saved playlists: ' + ', '.join(names))
+    else:
+        await ctx.send('No saved playlists')
+
+
+@bot.command(
+    name='history',
+    help='Searches the tracks played in this server, newest first.'
+)
+async def history(ctx: commands.Context, *args):
+    matches = bot.history.search(ctx.guild.id, ' '.join(args))
+    if matches:
+        embed = discord.Embed()
+        embed.title = 'History'
+        for item in matches:
+            embed.add_field(
+                name=item.entry.title, value=f'<t:{item.played_at}:R>',
+                inline=False
+            )
+        await ctx.send(embed=embed)
+    else:
+        await ctx.send('Nothing found in the history')
+
+
+@bot.command(
+    name='wrongmatch',
+    help='Reports the current track as the wrong match for a Spotify track.'
+)
+async def wrongmatch(ctx: commands.Context, *args):
+    player = get_player(ctx.guild.id)
+
+    if player.is_playing and player.current.track and bot.matcher.reject(
+        player.current.track
+    ):
+        await ctx.send(
+            f'"{player.current.title}" won\'t be matched to that Spotify '
+            'track again'
+        )
+    else:
+        await ctx.send('The current track wasn\'t matched from Spotify')
+
+
 @bot.command(
     name='disconnect',
     help='Disconnect the bot from the voice channel it is in.',
     aliases=('leave',)
 )
 async def disconnect(ctx: commands.Context, *args):
-    player = bot.lavalink.player_manager.get(ctx.guild.id)
+    player = get_player(ctx.guild.id)
 
     if not player.is_connected:
         # We can't disconnect, if we're not connected.
@@ -301,19 +621,16 @@ async def disconnect(ctx: commands.Context, *args):
 )
 async def np(ctx: commands.Context, *args):
 
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
-
-    current_duration = td(milliseconds=player.position_timestamp)
+    player = get_player(ctx.guild.id)
 
     if player.is_playing:
         current: lavalink.AudioTrack = player.current
+        length = 'live' if current.stream else format_time(current.duration)
         await ctx.send(
             f'Currently Playing: {current.title} '
-            f'at {current_duration.total_seconds() // 3600}:'
-            f'{current_duration.total_seconds() // 60}:'
-            f'{int(current_duration.total_seconds()) % 60}'
+            f'at {format_time(player.position)} / {length}, '
+            f'{format_time(time_until(player, len(player.queue)))} '
+            'left in the queue'
         )
     else:
         await ctx.send('Nothing currently playing, queue up a track!')
@@ -326,9 +643,7 @@ async def ping(ctx: commands.Context, *args):
 
 @bot.command(name='skip', help='Skips the currently playing song.')
 async def skip(ctx: commands.Context, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
     if player.is_playing:
         await player.skip()
         await ctx.send('Skipped')
@@ -340,9 +655,7 @@ async def skip(ctx: commands.Context, *args):
     name='seek', help='Seeks to a certain point in the current track.'
 )
 async def seek(ctx: commands.Context, timestamp: str, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
     if player.is_playing:
         try:
             td_ts = int(timeparse(timestamp)) * 1000
@@ -356,17 +669,13 @@ async def seek(ctx: commands.Context, timestamp: str, *args):
 
 @bot.command(name='remove', help='Removes a certain entry from the queue.')
 async def remove(ctx: commands.Context, idx: int, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
 
     if len(player.queue) > 0:
         if idx:
             try:
-                removed: lavalink.AudioTrack = player.queue[idx]
-                player.queue = [
-                    q for (i, q) in enumerate(player.queue) if i != idx-1
-                ]
+                removed = player.queue[idx-1]
+                del player.queue[idx-1]
                 await ctx.send(f'Removed "{removed.title}" at position {idx}')
             except Exception:
                 await ctx.send(f'Invalid index {idx}')
@@ -385,9 +694,7 @@ async def remove(ctx: commands.Context, idx: int, *args):
 
 @bot.command(name='loop', help='Loop the currently playing song.')
 async def loop(ctx: commands.Context, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
 
     if player.is_playing:
         player.set_repeat(True)
@@ -411,9 +718,7 @@ async def loop(ctx: commands.Context, *args):
 
 @bot.command(name='noloop', help='Stop looping')
 async def noloop(ctx: commands.Context, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
     player.set_repeat(False)
     await ctx.send('Looping disabled')
 
@@ -425,9 +730,7 @@ async def donate(ctx: commands.Context, *args):
 
 @bot.command(name='pause', help='Pauses the currently playing track')
 async def pause(ctx: commands.Context, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
     if player.is_playing:
         current: AudioTrack = player.current
         await player.set_pause(True)
@@ -438,9 +741,7 @@ async def pause(ctx: commands.Context, *args):
 
 @bot.command(name='resume', help='Resume paused music')
 async def resume(ctx: commands.Context, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
     if player.paused:
         await player.set_pause(False)
         await ctx.send(f'Resumed "{player.current.title}"')
@@ -456,9 +757,7 @@ async def resume(ctx: commands.Context, *args):
     )
 )
 async def move(ctx: commands.Context, start_idx: int, end_idx: int, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
     if len(player.queue) > 0:
         if not end_idx:
             end_idx = 1
@@ -483,13 +782,15 @@ async def move(ctx: commands.Context, start_idx: int, end_idx: int, *args):
 
 @bot.command(name='skipto', help='Skips to a certain position in the queue.')
 async def skipto(ctx: commands.Context, idx: int, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
     try:
-        qe = player.queue[idx-1]
-        while player.current != qe:
-            await skip(ctx)
+        if idx < 1:
+            raise IndexError(idx)
+        # Drop everything ahead of the entry and play it directly, so
+        # shuffle doesn't pick something else
+        track = player.queue.pop(idx-1)
+        del player.queue[:idx-1]
+        await player.play(track)
         await ctx.send(
             f'Skipped to "{player.current.title}" at position {idx}'
         )
@@ -499,9 +800,7 @@ async def skipto(ctx: commands.Context, idx: int, *args):
 
 @bot.command(name='clear', help='Clears the queue.')
 async def clear(ctx: commands.Context, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
     player.queue.clear()
     await ctx.send('Cleared queue')
 
@@ -554,32 +853,41 @@ async def clean(ctx: commands.Context, *args):
 
 @bot.command(name='shuffle', help='Shuffles the queue.')
 async def shuffle(ctx: commands.Context, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
-    player.set_shuffle(True)
+    player = get_player(ctx.guild.id)
+    # Reorder the queue itself rather than have the player pick at random,
+    # so the order !queue shows, start times included, is the play order
+    random.shuffle(player.queue)
     await ctx.send('Queue shuffled')
 
 
-@bot.command(name='noshuffle', help='Disables queue shuffling.')
+@bot.command(
+    name='noshuffle',
+    help='Shuffling only reorders the queue once, there is nothing to undo.'
+)
 async def unshuffle(ctx: commands.Context, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
     player.set_shuffle(False)
+    await ctx.send(
+        '!shuffle reorders the queue once, new tracks already play in order'
+    )
 
 
 @bot.command(name='queue', help='View the queue.')
 async def view_queue(ctx: commands.Context, *args):
-    player: lavalink.DefaultPlayer = bot.lavalink.player_manager.get(
-        ctx.guild.id
-    )
+    player = get_player(ctx.guild.id)
     if len(player.queue) > 0:
         embed = discord.Embed()
         embed.title = 'Queue'
+        embed.description = (
+            f'{format_time(time_until(player, len(player.queue)))} total'
+        )
         for i in range(len(player.queue)):
             embed.add_field(
-                name=f'Position {i+1}', value=player.queue[i].title,
+                name=f'Position {i+1}',
+                value=(
+                    f'{player.queue[i].title} '
+                    f'(in {format_time(time_until(player, i))})'
+                ),
                 inline=False
             )
         await ctx.send(embed=embed)
@@ -623,4 +931,6 @@ async def ross(ctx: commands.Context, *args):
     await play(ctx, '"BUSHES OF LOVE" -- Extended Lyric Video')
     await ctx.send('For daddy Ross <3')
 
-bot.run(BOT_TOKEN)
+
+if __name__ == '__main__':
+    bot.run(BOT_TOKEN)
@@ -0,0 +1,241 @@
+import asyncio
+from difflib import SequenceMatcher
+import os
+import re
+import sqlite3
+from time import time
+from typing import Awaitable, Callable, Optional
+import lavalink
+from lavalink.models import AudioTrack
+from musicman.util import SpotifyTrack
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS spotify_matches (
+    spotify_id TEXT PRIMARY KEY,
+    track TEXT,
+    score REAL NOT NULL,
+    matched_at INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS spotify_matches_track ON spotify_matches (track);
+CREATE TABLE IF NOT EXISTS spotify_rejects (
+    spotify_id TEXT NOT NULL,
+    track TEXT NOT NULL,
+    PRIMARY KEY (spotify_id, track)
+) WITHOUT ROWID;
+'''
+
+# Lowest score a match needs to be kept until someone reports it
+CONFIRM = 0.75
+# Seconds before a weaker match, or a search that found nothing, is
+# searched for again
+RETRY_UNCONFIRMED = 7 * 24 * 3600
+RETRY_NO_MATCH = 24 * 3600
+
+# Words that mark a different recording than the studio track, unless the
+# Spotify title has them too
+VARIANTS = (
+    'cover', 'live', 'remix', 'extended', 'karaoke', 'instrumental',
+    'nightcore', 'sped up', 'slowed', 'reverb', '8d', 'acoustic', 'hour',
+    'loop', 'reaction', 'tutorial', 'lesson',
+)
+
+word_rx = re.compile(r'\w+')
+
+
+def normalise(text: str):
+    return ' '.join(word_rx.findall(text.lower()))
+
+
+def similarity(a: str, b: str):
+    if not a or not b:
+        return 0.0
+    # Both are normalised, so padding with spaces only finds whole words
+    if f' {a} ' in f' {b} ':
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def score(sp_track: SpotifyTrack, track: dict):
+    """
+    Scores how likely a Lavalink search result is the Spotify track, from
+    0 to roughly 1. Length counts for most, then title and artist, with
+    small nudges from the uploading channel.
+    """
+    info = track['info']
+    if info['isStream']:
+        return 0.0
+
+    name = normalise(sp_track.name)
+    artist = normalise(sp_track.artist)
+    title = normalise(info['title'])
+    author = normalise(info['author'])
+
+    # Full marks within 3 seconds, nothing once 30 seconds out
+    delta = abs(info['length'] - sp_track.duration_ms) / 1000
+    duration = 1 - min(1.0, max(0.0, delta - 3) / 27)
+
+    artist_score = max(similarity(artist, author), similarity(artist, title))
+
+    channel = 0.0
+    if info['author'].endswith(' - Topic'):
+        # Auto-generated art tracks are the studio recording
+        channel += 0.1
+    elif 'vevo' in author.replace(' ', ''):
+        channel += 0.05
+    if 'official audio' in title:
+        channel += 0.05
+
+    variants = sum(
+        1 for v in VARIANTS
+        if re.search(rf'\b{v}\b', title) and not re.search(rf'\b{v}\b', name)
+    )
+
+    return (
+        0.45 * duration + 0.3 * similarity(name, title) +
+        0.25 * artist_score + channel - 0.35 * min(variants, 2)
+    )
+
+
+class SpotifyMatcher:
+    """
+    Finds the Lavalink track for a Spotify track. Candidates from a single
+    search are scored against Spotify's metadata, and the best one is
+    remembered by Spotify ID in SQLite (MUSICMAN_DB, defaults to
+    musicman.db), so every guild after the first skips the search.
+    Concurrent lookups of the same ID share one search.
+
+    Matches scoring CONFIRM or more are kept until reject() is called on
+    them. Weaker matches and searches that found nothing are kept too, but
+    searched for again once they are RETRY_UNCONFIRMED or RETRY_NO_MATCH
+    seconds old.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('MUSICMAN_DB', 'musicman.db')
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+        self._searching: dict[str, asyncio.Future] = {}
+
+    def cached(self, spotify_id: str):
+        """
+        Returns the remembered match, with None for the track if the last
+        search found nothing, or None if the ID has to be searched for.
+        """
+        row = self.db.execute(
+            'SELECT track, score, matched_at FROM spotify_matches '
+            'WHERE spotify_id = ?',
+            (spotify_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        track, match_score, matched_at = row
+        if track is None:
+            retry = RETRY_NO_MATCH
+        elif match_score < CONFIRM:
+            retry = RETRY_UNCONFIRMED
+        else:
+            return row
+        return row if matched_at >= time() - retry else None
+
+    def remember(
+        self, spotify_id: str, track: Optional[str], match_score: float
+    ):
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO spotify_matches '
+                '(spotify_id, track, score, matched_at) VALUES (?, ?, ?, ?)',
+                (spotify_id, track, match_score, int(time()))
+            )
+
+    def reject(self, track: str):
+        """
+        Forgets every Spotify match pointing at the encoded track and keeps
+        it from being picked for those Spotify tracks again. Returns how
+        many matches were dropped.
+        """
+        with self.db:
+            ids = self.db.execute(
+                'SELECT spotify_id FROM spotify_matches WHERE track = ?',
+                (track,)
+            ).fetchall()
+            self.db.executemany(
+                'INSERT OR IGNORE INTO spotify_rejects (spotify_id, track) '
+                'VALUES (?, ?)',
+                ((spotify_id, track) for spotify_id, in ids)
+            )
+            self.db.execute(
+                'DELETE FROM spotify_matches WHERE track = ?', (track,)
+            )
+        return len(ids)
+
+    def rejected(self, spotify_id: str):
+        return {
+            track for track, in self.db.execute(
+                'SELECT track FROM spotify_rejects WHERE spotify_id = ?',
+                (spotify_id,)
+            )
+        }
+
+    async def resolve(
+        self, sp_track: SpotifyTrack,
+        get_tracks: Callable[[str], Awaitable[dict]], requester: int
+    ) -> Optional[AudioTrack]:
+        if sp_track.id:
+            cached = self.cached(sp_track.id)
+            if cached:
+                if cached[0] is None:
+                    return None
+                track = lavalink.decode_track(cached[0])
+                track.requester = requester
+                return track
+
+            if sp_track.id in self._searching:
+                data = await asyncio.shield(self._searching[sp_track.id])
+                return AudioTrack(data, requester) if data else None
+
+        future = asyncio.get_running_loop().create_future()
+        if sp_track.id:
+            self._searching[sp_track.id] = future
+
+        data = None
+        try:
+            data = await self._search(sp_track, get_tracks)
+        finally:
+            future.set_result(data)
+            self._searching.pop(sp_track.id, None)
+
+        return AudioTrack(data, requester) if data else None
+
+    async def _search(
+        self, sp_track: SpotifyTrack,
+        get_tracks: Callable[[str], Awaitable[dict]]
+    ):
+        results = await get_tracks(
+            f'ytsearch:{sp_track.name} {sp_track.artist}'
+        )
+        if not results:
+            return None
+
+        rejected = self.rejected(sp_track.id) if sp_track.id else set()
+        candidates = [
+            t for t in results['tracks'] if t['track'] not in rejected
+        ]
+        if not candidates:
+            # A failed load may work next time, an empty search or one with
+            # only rejected results won't soon
+            if sp_track.id and results['loadType'] != 'LOAD_FAILED':
+                self.remember(sp_track.id, None, 0.0)
+            return None
+
+        best, best_score = max(
+            ((t, score(sp_track, t)) for t in candidates),
+            key=lambda pair: pair[1]
+        )
+
+        # Fallback-player results have no encoded track to remember
+        if sp_track.id and best['track']:
+            self.remember(sp_track.id, best['track'], best_score)
+
+        return best
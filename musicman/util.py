@@ -1,37 +1,257 @@
-from dataclasses import dataclass, field
+from base64 import b64decode, b64encode
 from enum import Enum
 from functools import partial
 from multiprocessing import Pool, cpu_count
+import re
+from sys import intern
 from traceback import print_exc
-from typing import Optional
+from typing import Iterable, NamedTuple, Optional, Union
 import discord
+from lavalink import decode_track
+from lavalink.models import AudioTrack
 import requests
 from yt_dlp import YoutubeDL
 
 
+# Prefer opus so FFmpegOpusAudio can hand the stream to Discord without
+# decoding and re-encoding it
+ytdl_options = {
+    'format': 'bestaudio[acodec=opus]/bestaudio/best',
+    'noplaylist': True,
+    'quiet': True,
+}
+
+
+url_rx = re.compile(r'https?://(?:www\.)?.+')
+
+
 class LoopState(Enum):
     OFF = 0
     NOW_PLAYING = 1
     QUEUE = 2
 
 
-@dataclass
+# Requester IDs seen so far, so every entry a user queues shares one int
+_requesters: dict[int, int] = {}
+
+
 class QueueEntry:
+    """
+    A queued track cut down to its decoded encoded-track bytes and the
+    fields the queue commands show. Titles and requester IDs are interned,
+    so guilds queueing the same songs and users queueing many share a copy.
+    """
+
+    __slots__ = ('blob', 'title', 'duration', 'requester', 'uri')
+
+    def __init__(
+        self, blob: Optional[bytes], title: str, duration: int,
+        requester: int, uri: Optional[str] = None
+    ):
+        self.blob = blob
+        self.title = intern(title)
+        self.duration = duration
+        self.requester = _requesters.setdefault(requester, requester)
+        # Encoded tracks carry their own URI, it is only kept for tracks
+        # the fallback player found without one
+        self.uri = None if blob else uri
+
+    @classmethod
+    def from_track(cls, track: AudioTrack):
+        # Streams report a huge length, they count as 0 towards queue time
+        return cls(
+            b64decode(track.track) if track.track else None, track.title,
+            0 if track.stream else track.duration, track.requester, track.uri
+        )
 
-    author: discord.User
-    url: str
-    audio: discord.FFmpegPCMAudio
-    title: str
+    @property
+    def track(self):
+        return b64encode(self.blob).decode() if self.blob else None
+
+    def materialise(self):
+        if self.blob:
+            at = decode_track(self.track)
+            at.requester = self.requester
+            return at
+
+        return AudioTrack({
+            'track': None,
+            'info': {
+                'identifier': '',
+                'isSeekable': True,
+                'author': '',
+                'length': self.duration,
+                'isStream': False,
+                'title': self.title,
+                'uri': self.uri,
+            }
+        }, self.requester)
+
+    def __repr__(self):
+        return f'<QueueEntry title={self.title}>'
+
+
+class TrackQueue(list):
+    """
+    A player queue holding QueueEntry items. AudioTracks are compacted as
+    they are added and only rebuilt when popped, which is how the players
+    take the next track to play.
+
+    Durations are kept in a Fenwick tree so eta() and duration answer in
+    O(log n). Appending, taking from either end and adding at the front
+    update it in O(log n); edits in the middle rebuild it in O(n), as the
+    list has to shift its items anyway.
+    """
+
+    def __init__(self, tracks: Iterable[Union[AudioTrack, QueueEntry]] = ()):
+        super().__init__(map(self._compact, tracks))
+        self._reindex()
+
+    @staticmethod
+    def _compact(track: Union[AudioTrack, QueueEntry]):
+        if isinstance(track, QueueEntry):
+            return track
+        return QueueEntry.from_track(track)
+
+    def _reindex(self):
+        # Slot i of the tree holds the item at index i - _head, the slots
+        # before _head belong to items already popped from the front
+        self._head = 0
+        self._size = max(16, 2 * len(self))
+        tree = [0] * (self._size + 1)
+        for i, entry in enumerate(self, 1):
+            tree[i] = entry.duration
+        for i in range(1, self._size + 1):
+            parent = i + (i & -i)
+            if parent <= self._size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _update(self, slot: int, delta: int):
+        i = slot + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, slot: int):
+        total = 0
+        while slot > 0:
+            total += self._tree[slot]
+            slot -= slot & -slot
+        return total
+
+    def _removed(self, index: int, entry: QueueEntry):
+        # index is where entry was, len(self) is already one smaller
+        if index == 0:
+            self._update(self._head, -entry.duration)
+            self._head += 1
+        elif index == len(self):
+            self._update(self._head + index, -entry.duration)
+        else:
+            self._reindex()
+
+    def eta(self, index: int):
+        """ Milliseconds of queued audio ahead of the entry at index. """
+        return self._prefix(self._head + index) - self._prefix(self._head)
+
+    @property
+    def duration(self):
+        """ Milliseconds of audio in the whole queue. """
+        return self.eta(len(self))
+
+    def append(self, track: Union[AudioTrack, QueueEntry]):
+        entry = self._compact(track)
+        super().append(entry)
+
+        slot = self._head + len(self) - 1
+        if slot < self._size:
+            self._update(slot, entry.duration)
+        else:
+            self._reindex()
+
+    def insert(self, index: int, track: Union[AudioTrack, QueueEntry]):
+        if index >= len(self):
+            return self.append(track)
+
+        entry = self._compact(track)
+        super().insert(index, entry)
+
+        if index == 0 and self._head > 0:
+            self._head -= 1
+            self._update(self._head, entry.duration)
+        else:
+            self._reindex()
+
+    def extend(self, tracks: Iterable[Union[AudioTrack, QueueEntry]]):
+        for track in tracks:
+            self.append(track)
+
+    def __iadd__(self, tracks: Iterable[Union[AudioTrack, QueueEntry]]):
+        self.extend(tracks)
+        return self
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            super().__setitem__(index, [self._compact(t) for t in value])
+            self._reindex()
+            return
+
+        entry = self._compact(value)
+        old = self[index]
+        super().__setitem__(index, entry)
+        slot = self._head + (index + len(self) if index < 0 else index)
+        self._update(slot, entry.duration - old.duration)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            super().__delitem__(index)
+            self._reindex()
+            return
+
+        entry = self[index]
+        super().__delitem__(index)
+        self._removed(index + len(self) + 1 if index < 0 else index, entry)
+
+    def pop(self, index: int = -1):
+        entry = super().pop(index)
+        self._removed(index + len(self) + 1 if index < 0 else index, entry)
+        return entry.materialise()
+
+    def remove(self, value: QueueEntry):
+        del self[self.index(value)]
+
+    def clear(self):
+        super().clear()
+        self._reindex()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._reindex()
+
+    def reverse(self):
+        super().reverse()
+        self._reindex()
+
+    def __imul__(self, n: int):
+        super().__imul__(n)
+        self._reindex()
+        return self
 
 
-@dataclass
 class MusicState:
 
-    guild_id: int
-    voiceclient: Optional[discord.VoiceClient] = None
-    queue: list[QueueEntry] = field(default_factory=list)
-    now_playing: Optional[QueueEntry] = None
-    ls: LoopState = LoopState.OFF
+    __slots__ = ('guild_id', 'voiceclient', 'queue', 'now_playing', 'ls')
+
+    def __init__(
+        self, guild_id: int, voiceclient: Optional[discord.VoiceClient] = None,
+        queue: Optional[TrackQueue] = None,
+        now_playing: Optional[AudioTrack] = None, ls: LoopState = LoopState.OFF
+    ):
+        self.guild_id = guild_id
+        self.voiceclient = voiceclient
+        self.queue = TrackQueue() if queue is None else queue
+        self.now_playing = now_playing
+        self.ls = ls
 
 
 def get_spotify_token(client: str, secret: str):
@@ -46,14 +266,37 @@ def get_spotify_token(client: str, secret: str):
     return resp.json()['access_token']
 
 
-def handle_spotify(client: str, secret: str, url: str):
+class SpotifyTrack(NamedTuple):
+
+    id: Optional[str]
+    name: str
+    artists: tuple[str, ...]
+    duration_ms: int
+
+    @classmethod
+    def from_json(cls, track: dict):
+        return cls(
+            track.get('id'), track['name'],
+            tuple(a['name'] for a in track['artists']), track['duration_ms']
+        )
+
+    @property
+    def artist(self):
+        return self.artists[0] if self.artists else ''
+
+
+def get_spotify_tracks(client: str, secret: str, url: str):
+    """
+    Returns the tracks behind a Spotify track, album or playlist URL, or
+    None if Spotify can't be reached or the URL is something else.
+    """
 
     token = get_spotify_token(client, secret)
 
-    item_type = url.split('/')[-2]
+    item_type = url.split('/')[-2].lower()
     item_id = url.split('/')[-1].split('?')[0]
 
-    if item_type.lower() == 'track':
+    if item_type == 'track':
 
         resp = requests.get(
             f'https://api.spotify.com/v1/tracks/{item_id}',
@@ -63,52 +306,49 @@ def handle_spotify(client: str, secret: str, url: str):
         if resp.status_code != 200:
             return None
 
-        track = resp.json()
-        artists = track['artists']
-
-        return (
-            f'{track["name"]} '
-            f'{artists[0]["name"] if len(artists) > 0 else ""}'
-        )
+        return [SpotifyTrack.from_json(resp.json())]
 
-    elif item_type.lower() in ('album', 'playlist'):
+    elif item_type in ('album', 'playlist'):
 
         resp = requests.get(
-            (
-                f'https://api.spotify.com/v1/'
-                f'{item_type.lower()}s/{item_id}/tracks'
-            ),
+            f'https://api.spotify.com/v1/{item_type}s/{item_id}/tracks',
             headers={'Authorization': f'Bearer {token}'}
         )
 
         if resp.status_code != 200:
             return None
 
-        item = resp.json()
-        tracks = item['items']
-
         return [
-            (
-                f'{track["name"]} - '
-                f'{track["artists"][0]["name"] if len(track["artists"]) > 0 else ""}'  # noqa: E501
-            ) if item_type.lower() == 'album' else (
-                f'{track["track"]["name"]} - '
-                f'{track["track"]["artists"][0]["name"] if len(track["track"]["artists"]) > 0 else ""}'  # noqa: E501
+            SpotifyTrack.from_json(
+                track if item_type == 'album' else track['track']
             )
-            for track in tracks
+            for track in resp.json()['items']
         ]
 
+    return None
+
+
+def handle_spotify(client: str, secret: str, url: str):
+
+    tracks = get_spotify_tracks(client, secret, url)
+
+    if tracks is None:
+        return None
+
+    if url.split('/')[-2].lower() == 'track':
+        return f'{tracks[0].name} {tracks[0].artist}'
+
+    return [f'{track.name} - {track.artist}' for track in tracks]
+
 
 def get_audio(options: dict[str, str], src: str, *args):
     kw: str = ' '.join([src, *args])
     try:
         audio_dl = YoutubeDL(options)
+        # URLs from any site yt-dlp supports go straight to it, only plain
+        # text is searched for
         resp = audio_dl.extract_info(
-            (
-                f'ytsearch:{kw}'
-                if 'www.youtube.com' not in [s.lower() for s in kw.split('/')]
-                else kw
-            ), download=False
+            kw if url_rx.match(kw) else f'ytsearch:{kw}', download=False
         )
         return resp['entries'][0] if 'entries' in resp else resp
     except Exception: